@@ -2,13 +2,34 @@
 """
 Script to copy all tables from a development database to a production database.
 This version handles foreign key constraints by temporarily disabling them per table.
+Several target databases can be given; each table is read once and written to all
+targets concurrently, with failures isolated per target. Each freshly loaded table
+is then analyzed (and optionally frozen) on a bounded pool so its planner statistics
+are current as soon as the run finishes.
 """
 
 import psycopg2
 import sys
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 import argparse
 
+# Batches buffered per target before a slow target holds up the shared reader
+DEFAULT_BUFFER_BATCHES = 16
+
+# Seconds a target may keep its buffer full before it is dropped for the table
+DEFAULT_TARGET_TIMEOUT = 60
+
+# Concurrent ANALYZE/VACUUM sessions per run
+DEFAULT_MAINTENANCE_WORKERS = 4
+
+# Queue markers telling a writer whether to commit or roll back the table
+END_OF_TABLE = object()
+ABORT_TABLE = object()
+
 def parse_db_url(url):
     """Parse a PostgreSQL URL into connection parameters."""
     parsed = urlparse(url)
@@ -81,8 +102,60 @@ def enable_foreign_keys_all(conn):
     
     conn.commit()
 
-def copy_table(dev_conn, prod_conn, table_name):
-    """Copy a single table from development to production."""
+def target_label(db_url):
+    """Build a printable name for a target database without its credentials."""
+    params = parse_db_url(db_url)
+    return f"{params['host']}:{params['port']}/{params['database']}"
+
+def write_target(prod_conn, table_name, insert_sql, batches, result, on_loaded=None):
+    """Drain batches from a queue into one target; runs in its own thread."""
+    rows = None
+    try:
+        # Delete all data from the production table
+        with prod_conn.cursor() as prod_cur:
+            prod_cur.execute(f'DELETE FROM "{table_name}";')
+            
+            while True:
+                rows = batches.get()
+                if result['timed_out']:
+                    raise RuntimeError("target timed out")
+                if rows is END_OF_TABLE:
+                    break
+                if rows is ABORT_TABLE:
+                    raise RuntimeError("source read failed")
+                prod_cur.executemany(insert_sql, rows)
+        
+        prod_conn.commit()
+        result['success'] = True
+        
+    except Exception as e:
+        try:
+            prod_conn.rollback()
+        except Exception:
+            pass
+        if result['error'] is None:
+            result['error'] = e
+        # Keep draining so the reader never blocks on a failed target
+        while rows not in (END_OF_TABLE, ABORT_TABLE) and not result['timed_out']:
+            rows = batches.get()
+    
+    if result['success'] and on_loaded is not None:
+        try:
+            on_loaded()
+        except Exception as e:
+            print(f"  Warning: Could not schedule maintenance for {table_name}: {e}")
+
+def copy_table(dev_conn, targets, table_name, buffer_batches=DEFAULT_BUFFER_BATCHES,
+               target_timeout=DEFAULT_TARGET_TIMEOUT, on_loaded=None):
+    """Read a table once from development and write it to every target concurrently.
+    
+    A target whose buffer stays full for target_timeout seconds is rolled back and
+    no longer fed, so the other targets keep streaming. on_loaded(label) is called
+    from a target's writer as soon as that target has committed the table.
+    
+    Returns a dict mapping each target label to True/False, or None for a target
+    whose writer is still stuck and must not be used again this run.
+    """
     print(f"Copying table: {table_name}")
     
     # Get column names to ensure proper ordering
@@ -97,39 +170,94 @@ def copy_table(dev_conn, prod_conn, table_name):
     
     if not columns:
         print(f"  Warning: No columns found for table {table_name}")
-        return False
+        return {label: False for label in targets}
     
     column_list = ', '.join(f'"{col}"' for col in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    insert_sql = f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})'
     
+    # One bounded queue and writer thread per target
+    writers = {}
+    for label, prod_conn in targets.items():
+        batches = queue.Queue(maxsize=buffer_batches)
+        result = {'success': False, 'error': None, 'timed_out': False}
+        thread = threading.Thread(
+            target=write_target,
+            args=(prod_conn, table_name, insert_sql, batches, result,
+                  on_loaded and (lambda label=label: on_loaded(label))),
+            name=f"copy-{table_name}-{label}",
+            daemon=True,
+        )
+        thread.start()
+        writers[label] = (thread, batches, result)
+    
+    def feed(label, item):
+        """Hand an item to one writer, giving up on it once its buffer stays full."""
+        thread, batches, result = writers[label]
+        try:
+            batches.put(item, timeout=target_timeout)
+        except queue.Full:
+            result['error'] = TimeoutError(f"buffer stayed full for {target_timeout}s")
+            result['timed_out'] = True
+            print(f"  ✗ {label} stopped keeping up with {table_name}, dropping it for this table")
+    
+    # Anything short of a complete read, including Ctrl-C, rolls every target back
+    end_marker = ABORT_TABLE
     try:
-        # Delete all data from the production table
-        with prod_conn.cursor() as prod_cur:
-            prod_cur.execute(f'DELETE FROM "{table_name}";')
-        
-        # Copy data from development to production
+        # Copy data from development to every target
         with dev_conn.cursor() as dev_cur:
             dev_cur.execute(f'SELECT {column_list} FROM "{table_name}";')
             
-            # Process in batches for better performance
-            with prod_conn.cursor() as prod_cur:
-                while True:
-                    rows = dev_cur.fetchmany(1000)  # Process in batches
-                    if not rows:
-                        break
-                    
-                    # Insert batch
-                    placeholders = ', '.join(['%s'] * len(columns))
-                    insert_sql = f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})'
-                    prod_cur.executemany(insert_sql, rows)
-        
-        prod_conn.commit()
-        print(f"  ✓ Successfully copied {table_name}")
-        return True
+            while True:
+                rows = dev_cur.fetchmany(1000)  # Process in batches
+                if not rows:
+                    break
+                
+                for label, (thread, batches, result) in writers.items():
+                    if result['error'] is None:
+                        feed(label, rows)
         
+        end_marker = END_OF_TABLE
+    
     except Exception as e:
-        prod_conn.rollback()
-        print(f"  ✗ Error copying {table_name}: {e}")
-        return False
+        # Abort every target so none of them commits a partial table
+        print(f"  ✗ Error reading {table_name}: {e}")
+        dev_conn.rollback()
+    
+    finally:
+        for label, (thread, batches, result) in writers.items():
+            if not result['timed_out']:
+                feed(label, end_marker)
+            if result['timed_out']:
+                # Wake the writer if it is waiting on an empty queue
+                try:
+                    batches.put_nowait(ABORT_TABLE)
+                except queue.Full:
+                    pass
+                # Interrupt whatever statement has it stuck
+                try:
+                    targets[label].cancel()
+                except Exception:
+                    pass
+        for label, (thread, batches, result) in writers.items():
+            if result['timed_out']:
+                thread.join(target_timeout)
+            else:
+                thread.join()
+    
+    outcome = {}
+    for label, (thread, batches, result) in writers.items():
+        if thread.is_alive():
+            outcome[label] = None
+            print(f"  ✗ {label} is still stuck on {table_name}: {result['error']}")
+            continue
+        outcome[label] = result['success']
+        if result['success']:
+            print(f"  ✓ Successfully copied {table_name} -> {label}")
+        else:
+            print(f"  ✗ Error copying {table_name} -> {label}: {result['error']}")
+    
+    return outcome
 
 def reset_sequences(prod_conn, tables):
     """Reset all sequence values to match the current max values in tables."""
@@ -161,25 +289,154 @@ def reset_sequences(prod_conn, tables):
         
         prod_conn.commit()
 
+class MaintenancePool:
+    """Run ANALYZE or VACUUM (FREEZE, ANALYZE) on loaded tables across a bounded pool."""
+    
+    def __init__(self, workers, freeze=False):
+        self.freeze = freeze
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="maintenance")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.futures = []
+        self.aborted = False
+    
+    def _connection(self, db_url):
+        """Reuse one autocommit connection per worker thread and target."""
+        conns = getattr(self.local, 'conns', None)
+        if conns is None:
+            conns = self.local.conns = {}
+        if db_url not in conns:
+            conn = get_connection(db_url)
+            # VACUUM cannot run inside a transaction block
+            conn.autocommit = True
+            with self.lock:
+                if not self.aborted:
+                    self.connections.append(conn)
+                    conns[db_url] = conn
+            if db_url not in conns:
+                # abort() already ran and will never see this session
+                conn.close()
+        with self.lock:
+            if self.aborted:
+                raise RuntimeError("maintenance aborted")
+        return conns[db_url]
+    
+    def _run(self, db_url, table_name):
+        if self.freeze:
+            sql = f'VACUUM (FREEZE, ANALYZE) "{table_name}";'
+        else:
+            sql = f'ANALYZE "{table_name}";'
+        
+        conn = self._connection(db_url)
+        start = time.monotonic()
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        return time.monotonic() - start
+    
+    def submit(self, label, db_url, table_name):
+        """Schedule maintenance for a table that has just been loaded."""
+        future = self.executor.submit(self._run, db_url, table_name)
+        with self.lock:
+            self.futures.append((label, table_name, future))
+    
+    def wait(self):
+        """Wait for every scheduled table and return {label: [(table, seconds, error)]}."""
+        results = {}
+        for label, table_name, future in self.futures:
+            try:
+                results.setdefault(label, []).append((table_name, future.result(), None))
+            except Exception as e:
+                results.setdefault(label, []).append((table_name, None, e))
+        self.executor.shutdown()
+        self._close()
+        
+        return results
+    
+    def abort(self):
+        """Drop queued tables, cancel running statements and close every session."""
+        with self.lock:
+            self.aborted = True
+            connections = list(self.connections)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for conn in connections:
+            try:
+                conn.cancel()
+            except:
+                pass
+        self._close()
+    
+    def _close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except:
+                pass
+
 def main():
-    parser = argparse.ArgumentParser(description='Copy all tables from development to production database')
+    parser = argparse.ArgumentParser(description='Copy all tables from development to one or more production databases')
     parser.add_argument('dev_url', help='Development database URL')
-    parser.add_argument('prod_url', help='Production database URL')
+    parser.add_argument('prod_urls', nargs='+', metavar='prod_url', help='Production database URL (repeat for several targets)')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be copied without actually doing it')
+    parser.add_argument('--buffer-batches', type=int, default=DEFAULT_BUFFER_BATCHES,
+                        help=f'Batches of 1000 rows buffered per target before a slow target holds up the reader (default: {DEFAULT_BUFFER_BATCHES})')
+    parser.add_argument('--target-timeout', type=float, default=DEFAULT_TARGET_TIMEOUT,
+                        help=f'Seconds a target may keep its buffer full before it is dropped for that table (default: {DEFAULT_TARGET_TIMEOUT})')
+    parser.add_argument('--maintenance-workers', type=int, default=DEFAULT_MAINTENANCE_WORKERS,
+                        help=f'Concurrent ANALYZE/VACUUM sessions after each table loads (default: {DEFAULT_MAINTENANCE_WORKERS})')
+    maintenance_mode = parser.add_mutually_exclusive_group()
+    maintenance_mode.add_argument('--vacuum-freeze', action='store_true', help='Run VACUUM (FREEZE, ANALYZE) instead of ANALYZE on each loaded table')
+    maintenance_mode.add_argument('--skip-maintenance', action='store_true', help='Do not analyze or vacuum tables after loading')
     
     args = parser.parse_args()
     
+    if args.buffer_batches < 1:
+        parser.error('--buffer-batches must be at least 1')
+    if args.target_timeout <= 0:
+        parser.error('--target-timeout must be positive')
+    if args.maintenance_workers < 1:
+        parser.error('--maintenance-workers must be at least 1')
+    
+    labels = {}
+    for position, url in enumerate(args.prod_urls, 1):
+        try:
+            label = target_label(url)
+        except ValueError as e:
+            parser.error(f'target URL #{position} is invalid: {e}')
+        if label in labels.values():
+            parser.error(f'target {label} was given more than once')
+        labels[url] = label
+    urls = {label: url for url, label in labels.items()}
+    
     if not args.dry_run:
-        response = input("This will OVERWRITE all data in the production database. Are you sure? (yes/no): ")
+        print("Targets:")
+        for url in args.prod_urls:
+            print(f"  - {labels[url]}")
+        response = input("This will OVERWRITE all data in every target database. Are you sure? (yes/no): ")
         if response.lower() != 'yes':
             print("Operation cancelled.")
             return
     
+    dev_conn = None
+    targets = {}
+    stuck = {}
     try:
-        # Connect to both databases
+        # Connect to the development database and every target
         print("Connecting to databases...")
         dev_conn = get_connection(args.dev_url)
-        prod_conn = get_connection(args.prod_url)
+        
+        unreachable = {}
+        for url in args.prod_urls:
+            try:
+                targets[labels[url]] = get_connection(url)
+            except Exception as e:
+                print(f"  ✗ Could not connect to {labels[url]}: {e}")
+                unreachable[labels[url]] = e
+        
+        if not targets:
+            raise RuntimeError("no target database is reachable")
         
         # Get list of tables
         print("Getting table list...")
@@ -187,39 +444,99 @@ def main():
         print(f"Found {len(tables)} tables: {', '.join(tables)}")
         
         if args.dry_run:
-            print("DRY RUN - Would copy the following tables:")
+            print(f"DRY RUN - Would copy the following tables to {len(targets)} target(s):")
             for table in tables:
                 print(f"  - {table}")
             return
         
-        # Disable all foreign key constraints
-        disable_foreign_keys_all(prod_conn)
+        # Disable all foreign key constraints on every target
+        for label, prod_conn in list(targets.items()):
+            try:
+                disable_foreign_keys_all(prod_conn)
+            except Exception as e:
+                print(f"  ✗ Could not prepare {label}, skipping it: {e}")
+                unreachable[label] = e
+                prod_conn.close()
+                del targets[label]
+        
+        successful_tables = {label: [] for label in targets}
+        failed_tables = {label: [] for label in targets}
+        maintenance_results = {}
+        
+        maintenance = None
+        if not args.skip_maintenance:
+            maintenance = MaintenancePool(args.maintenance_workers, freeze=args.vacuum_freeze)
         
         try:
-            # Copy each table
-            successful_tables = []
-            failed_tables = []
-            
+            # Copy each table, reading it once for all targets; each target queues
+            # its maintenance the moment it commits, not after the slowest target
             for table in tables:
-                success = copy_table(dev_conn, prod_conn, table)
-                if success:
-                    successful_tables.append(table)
-                else:
-                    failed_tables.append(table)
+                on_loaded = None
+                if maintenance is not None:
+                    on_loaded = lambda label, table=table, pool=maintenance: pool.submit(label, urls[label], table)
+                outcome = copy_table(dev_conn, targets, table, args.buffer_batches,
+                                     args.target_timeout, on_loaded)
+                for label, success in outcome.items():
+                    if success is None:
+                        # Its connection is still busy; stop using this target
+                        stuck[label] = targets.pop(label)
+                        unreachable[label] = (f"stuck while copying {table}; "
+                                              "constraints may still be disabled")
+                    elif success:
+                        successful_tables[label].append(table)
+                    else:
+                        failed_tables[label].append(table)
             
             # Reset sequences for successful tables
-            if successful_tables:
-                reset_sequences(prod_conn, successful_tables)
+            for label, prod_conn in targets.items():
+                if successful_tables[label]:
+                    try:
+                        reset_sequences(prod_conn, successful_tables[label])
+                    except Exception as e:
+                        print(f"  ✗ Error resetting sequences on {label}: {e}")
+            
+            # Drain maintenance first: ENABLE TRIGGER conflicts with ANALYZE/VACUUM
+            # locks and would hold up prod writes behind the slowest job
+            if maintenance is not None:
+                print("Waiting for post-load maintenance...")
+                maintenance_results = maintenance.wait()
+                maintenance = None
             
         finally:
+            if maintenance is not None:
+                # The run was interrupted; don't wait for queued maintenance
+                maintenance.abort()
+                maintenance = None
+            
             # Re-enable all foreign key constraints
-            enable_foreign_keys_all(prod_conn)
+            for label, prod_conn in targets.items():
+                try:
+                    enable_foreign_keys_all(prod_conn)
+                except Exception as e:
+                    print(f"  ✗ Could not re-enable constraints on {label}: {e}")
         
         print(f"\n📊 Summary:")
-        print(f"  ✓ Successfully copied: {len(successful_tables)} tables")
-        if failed_tables:
-            print(f"  ✗ Failed to copy: {len(failed_tables)} tables")
-            print(f"    Failed tables: {', '.join(failed_tables)}")
+        for label in targets:
+            print(f"  {label}:")
+            print(f"    ✓ Successfully copied: {len(successful_tables[label])} tables")
+            if failed_tables[label]:
+                print(f"    ✗ Failed to copy: {len(failed_tables[label])} tables")
+                print(f"      Failed tables: {', '.join(failed_tables[label])}")
+            if maintenance_results.get(label):
+                operation = 'VACUUM (FREEZE, ANALYZE)' if args.vacuum_freeze else 'ANALYZE'
+                print(f"    {operation}:")
+                for table, elapsed, error in maintenance_results[label]:
+                    if error is None:
+                        print(f"      ✓ {table}: {elapsed:.2f}s")
+                    else:
+                        print(f"      ✗ {table}: {error}")
+        for label, e in unreachable.items():
+            print(f"  {label}:")
+            print(f"    ✗ Skipped: {e}")
+        
+        if unreachable or any(failed_tables[label] for label in targets):
+            print("⚠️  Table copying completed with errors")
+            sys.exit(1)
         
         print("✓ Table copying completed!")
         
@@ -229,11 +546,12 @@ def main():
     
     finally:
         # Close connections
-        try:
-            dev_conn.close()
-            prod_conn.close()
-        except:
-            pass
+        for conn in [dev_conn, *targets.values(), *stuck.values()]:
+            try:
+                if conn is not None:
+                    conn.close()
+            except:
+                pass
 
 if __name__ == "__main__":
     main()